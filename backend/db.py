@@ -1,11 +1,63 @@
-from sqlmodel import SQLModel, create_engine, Session
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-DATABASE_URL = "sqlite:///focus.db"
+from models import FocusSession
 
-engine = create_engine(DATABASE_URL, echo=False)
+DATABASE_URL = "sqlite+aiosqlite:///focus.db"
 
+# SQLite's page cache lives on the connection, so keep a fixed set of long-lived
+# connections rather than opening and discarding overflow ones. Each connection
+# is used by one session at a time; requests beyond the pool wait for a free one.
+DB_POOL_SIZE = 20
+
+engine = create_async_engine(
+    DATABASE_URL,
+    echo=False,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=0,
+)
+
+# Applied to every new SQLite connection: WAL so readers don't block the writer,
+# NORMAL sync (safe under WAL), in-memory temp tables, 64 MB page cache,
+# 256 MB mmap, and a busy timeout instead of immediate "database is locked".
+SQLITE_PRAGMAS = (
+    "journal_mode=WAL",
+    "synchronous=NORMAL",
+    "temp_store=MEMORY",
+    "cache_size=-64000",
+    "mmap_size=268435456",
+    "busy_timeout=5000",
+)
+
+
+@event.listens_for(engine.sync_engine, "connect")
+def _set_sqlite_pragmas(dbapi_conn, _connection_record):
+    cursor = dbapi_conn.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(f"PRAGMA {pragma}")
+    cursor.close()
 
-def get_session():
-    with Session(engine) as session:
-        yield session
 
+def _create_schema(conn) -> None:
+    SQLModel.metadata.create_all(conn)
+    # create_all skips tables that already exist, so add newer indexes to old DBs.
+    for index in FocusSession.__table__.indexes:
+        index.create(conn, checkfirst=True)
+    # Indexes made redundant by the primary key and ix_user_started_desc.
+    for name in ("ix_focussession_id", "ix_focussession_user_id"):
+        conn.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
+
+
+async def create_schema() -> None:
+    """Create tables and indexes that don't exist yet. Idempotent."""
+    async with engine.begin() as conn:
+        await conn.run_sync(_create_schema)
+
+
+async def get_session():
+    # Rows are fully populated client-side, so returning them after commit
+    # must not trigger a reload SELECT (lazy loads aren't allowed under asyncio).
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        yield session
@@ -0,0 +1,8 @@
+from fastapi import HTTPException
+
+
+def require_user_id(user_id: str | None) -> str:
+    """Return the X-User-Id header value, or 400 if the client didn't send one."""
+    if not user_id:
+        raise HTTPException(status_code=400, detail="Missing X-User-Id header")
+    return user_id
@@ -3,16 +3,18 @@ from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from sqlmodel import SQLModel
 
-from db import engine
+from db import create_schema, engine
 from routers import breakdown, sessions
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    SQLModel.metadata.create_all(engine)
+    # No-op when scripts/serve.sh already created the schema before forking workers.
+    await create_schema()
     yield
+    await breakdown.close_client()
+    await engine.dispose()
 
 
 load_dotenv()
@@ -35,13 +37,13 @@ app.add_middleware(
 
 
 @app.get("/health")
-def health():
+async def health():
     """Check that the API is running."""
     return {"status": "ok", "message": "Focus Flow API is running"}
 
 
 @app.get("/")
-def root():
+async def root():
     """Root welcome."""
     return {"app": "Focus Flow", "docs": "/docs"}
 
@@ -3,13 +3,24 @@ from __future__ import annotations
 from datetime import datetime
 from typing import Optional
 
+from sqlalchemy import Index, text
 from sqlmodel import SQLModel, Field
 
 
 class FocusSession(SQLModel, table=True):
-    id: str = Field(primary_key=True, index=True)
-    user_id: str = Field(index=True)
+    __table_args__ = (
+        Index("ix_user_started_desc", "user_id", text("started_at DESC")),
+    )
+
+    # No single-column indexes: the primary key already indexes id, and
+    # ix_user_started_desc's leading column serves user_id lookups.
+    id: str = Field(primary_key=True)
+    user_id: str
     task_title: str
-    started_at: datetime
+    started_at: datetime  # always UTC (read back naive on SQLite)
     ended_at: Optional[datetime] = None
 
+
+class BreakdownBatch(SQLModel, table=True):
+    id: str = Field(primary_key=True)
+    user_id: str = Field(index=True)
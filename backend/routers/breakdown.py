@@ -1,11 +1,24 @@
 """
 Task breakdown: break vague tasks into concrete steps with time estimates (Phase 2).
 """
-import json
+import asyncio
+import hashlib
+import io
 import os
-import re
-from fastapi import APIRouter, HTTPException
+
+import httpx
+import orjson
+from cachetools import TTLCache
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import StreamingResponse
+from openai import AsyncOpenAI
 from pydantic import BaseModel
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from db import get_session
+from deps import require_user_id
+from models import BreakdownBatch
 
 router = APIRouter(prefix="/api", tags=["breakdown"])
 
@@ -24,50 +37,297 @@ Reply with ONLY a JSON array of objects, no other text. Each object must have ex
 Example: [{"title": "Read the brief", "estimated_minutes": 10}, {"title": "Draft outline", "estimated_minutes": 25}]"""
 
 
+BREAKDOWN_MODEL = "gpt-4o-mini"
+
+
+def _breakdown_body(task: str) -> dict:
+    """Chat completion request body for breaking down a single task."""
+    return {
+        "model": BREAKDOWN_MODEL,
+        "messages": [
+            {"role": "system", "content": BREAKDOWN_SYSTEM},
+            {"role": "user", "content": task},
+        ],
+        "temperature": 0.3,
+    }
+
+
+# Parsed steps for recently broken-down tasks, keyed by _cache_key(task).
+_breakdown_cache: TTLCache = TTLCache(maxsize=2048, ttl=3600)
+_breakdown_cache_lock = asyncio.Lock()
+
+
+def _cache_key(task: str) -> str:
+    """Normalize task text (trim, casefold) and hash it."""
+    return hashlib.blake2b(task.strip().casefold().encode(), digest_size=16).hexdigest()
+
+
+_client: AsyncOpenAI | None = None
+
+
+def _get_client() -> AsyncOpenAI:
+    """
+    Shared async OpenAI client, built on first use so connections are reused.
+    Raises 503 if OPENAI_API_KEY is not configured.
+    """
+    global _client
+    if _client is None:
+        api_key = (os.getenv("OPENAI_API_KEY") or "").strip()
+        if not api_key or api_key.startswith("your-"):
+            raise HTTPException(
+                status_code=503,
+                detail="OpenAI API key not configured. Add OPENAI_API_KEY to backend/.env (see .env.example).",
+            )
+        # One HTTP/2 keep-alive pool per process: concurrent completions are
+        # multiplexed over few connections instead of a TLS handshake per burst.
+        timeout = httpx.Timeout(30.0, connect=5.0)
+        _client = AsyncOpenAI(
+            api_key=api_key,
+            max_retries=2,
+            timeout=timeout,
+            http_client=httpx.AsyncClient(
+                http2=True,
+                limits=httpx.Limits(max_connections=200, max_keepalive_connections=50),
+                timeout=timeout,
+            ),
+        )
+    return _client
+
+
+async def close_client() -> None:
+    """Close the shared OpenAI client (called on app shutdown)."""
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+
 def parse_steps_from_response(content: str) -> list[dict]:
     """Extract JSON array from model response (may be wrapped in markdown)."""
-    content = content.strip()
-    if "```" in content:
-        match = re.search(r"```(?:json)?\s*([\s\S]*?)```", content)
-        if match:
-            content = match.group(1).strip()
-    data = json.loads(content)
+    return _coerce_steps(orjson.loads(_strip_fence(content.strip())))
+
+
+def _strip_fence(content: str) -> str:
+    """
+    Return the body of the first ```/```json fenced block, or content unchanged.
+    Equivalent to re.search(r"```(?:json)?\s*([\s\S]*?)```"), but str.find
+    jumps straight to the fences instead of stepping the regex engine per character.
+    """
+    start = content.find("```")
+    if start == -1:
+        return content
+    start += 3
+    end = content.find("```", start)
+    if end == -1:
+        return content
+    if content.startswith("json", start) and start + 4 <= end:
+        start += 4
+    return content[start:end].strip()
+
+
+def _coerce_steps(data) -> list[dict]:
+    """Normalize a decoded JSON array of steps to title/estimated_minutes dicts."""
     if not isinstance(data, list):
         raise ValueError("Expected a JSON array")
-    return [
-        {"title": str(s.get("title", "")), "estimated_minutes": int(s.get("estimated_minutes", 25))}
-        for s in data
-    ]
+    steps = []
+    for s in data:
+        if not isinstance(s, dict):
+            raise ValueError("Expected each step to be a JSON object")
+        # The system prompt asks for exactly these types; only coerce on mismatch.
+        title = s.get("title", "")
+        minutes = s.get("estimated_minutes", 25)
+        if type(minutes) is not int:
+            try:
+                minutes = int(minutes)
+            except (TypeError, ValueError, OverflowError):
+                raise ValueError(f"Invalid estimated_minutes: {minutes!r}") from None
+        steps.append({
+            "title": title if type(title) is str else str(title),
+            "estimated_minutes": minutes,
+        })
+    return steps
 
 
-@router.post("/breakdown", response_model=list)
-def breakdown_task(req: BreakdownRequest):
+@router.post("/breakdown", response_model=None)
+async def breakdown_task(req: BreakdownRequest) -> list[dict]:
     """
     Break a vague task into concrete steps with time estimates.
-    Requires OPENAI_API_KEY in .env.
+    Requires OPENAI_API_KEY in .env. Repeats of a recent task are served from cache.
     """
-    api_key = (os.getenv("OPENAI_API_KEY") or "").strip()
-    if not api_key or api_key.startswith("your-"):
+    key = _cache_key(req.task)
+    async with _breakdown_cache_lock:
+        cached = _breakdown_cache.get(key)
+    if cached is not None:
+        return cached
+    client = _get_client()
+    try:
+        steps = await _breakdown_one(client, req.task)
+    except orjson.JSONDecodeError as e:
+        raise HTTPException(status_code=502, detail=f"Could not parse AI response as JSON: {e}")
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    async with _breakdown_cache_lock:
+        _breakdown_cache[key] = steps
+    return steps
+
+
+# Each task gets its own completion. Tasks from different users are deliberately
+# not coalesced into one multi-task prompt: any task can steer the model's answer
+# for the others. Bulk work goes through the Batch API endpoints below instead.
+
+
+async def _breakdown_one(client: AsyncOpenAI, task: str) -> list[dict]:
+    resp = await client.chat.completions.create(**_breakdown_body(task))
+    content = (resp.choices[0].message.content or "").strip()
+    if not content:
+        raise ValueError("Empty response from model")
+    return parse_steps_from_response(content)
+
+
+async def _stream_breakdown(client: AsyncOpenAI, task: str):
+    """
+    Yield the model's output as server-sent events. Each delta is sent as a JSON
+    string so embedded newlines can't break SSE framing; ends with [DONE].
+    """
+    parts: list[str] = []
+    try:
+        stream = await client.chat.completions.create(**_breakdown_body(task), stream=True)
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                yield b"data: " + orjson.dumps(delta) + b"\n\n"
+    except Exception as e:
+        yield b"event: error\ndata: " + orjson.dumps(str(e)) + b"\n\n"
+        return
+    try:
+        steps = parse_steps_from_response("".join(parts))
+    except ValueError:
+        pass
+    else:
+        async with _breakdown_cache_lock:
+            _breakdown_cache[_cache_key(task)] = steps
+    yield b"data: [DONE]\n\n"
+
+
+@router.post("/breakdown/stream")
+async def breakdown_stream(req: BreakdownRequest):
+    """
+    Same as /breakdown, but streams the model's JSON output as it is generated
+    (text/event-stream). The client parses the array once [DONE] arrives.
+    """
+    client = _get_client()
+    return StreamingResponse(
+        _stream_breakdown(client, req.task), media_type="text/event-stream"
+    )
+
+
+# --- Batch API (bulk breakdowns at half cost, asynchronous turnaround) ---
+
+MAX_BATCH_TASKS = 500
+
+
+async def submit_batch(client: AsyncOpenAI, requests: list[BreakdownRequest]) -> str:
+    """
+    Upload the tasks as one JSONL Batch API job. Returns the OpenAI batch id.
+    Each line's custom_id is "task-<index>" so results map back to submission order.
+    """
+    buf = io.BytesIO()
+    for i, r in enumerate(requests):
+        line = {
+            "custom_id": f"task-{i}",
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": _breakdown_body(r.task),
+        }
+        buf.write(orjson.dumps(line) + b"\n")
+    buf.seek(0)
+    upload = await client.files.create(file=("breakdown.jsonl", buf), purpose="batch")
+    batch = await client.batches.create(
+        input_file_id=upload.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    return batch.id
+
+
+@router.post("/breakdown/batch")
+async def breakdown_batch(
+    requests: list[BreakdownRequest],
+    db: AsyncSession = Depends(get_session),
+    user_id: str | None = Header(default=None, alias="X-User-Id"),
+):
+    """
+    Submit many tasks as one OpenAI Batch API job.
+    Results arrive within 24h; poll the returned status_url.
+    """
+    uid = require_user_id(user_id)
+    if not requests:
+        raise HTTPException(status_code=400, detail="No tasks to break down")
+    if len(requests) > MAX_BATCH_TASKS:
         raise HTTPException(
-            status_code=503,
-            detail="OpenAI API key not configured. Add OPENAI_API_KEY to backend/.env (see .env.example).",
+            status_code=400, detail=f"At most {MAX_BATCH_TASKS} tasks per batch"
         )
+    client = _get_client()
     try:
-        from openai import OpenAI
-        client = OpenAI(api_key=api_key)
-        resp = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": BREAKDOWN_SYSTEM},
-                {"role": "user", "content": req.task},
-            ],
-            temperature=0.3,
-        )
-        content = (resp.choices[0].message.content or "").strip()
-        if not content:
-            raise ValueError("Empty response from model")
+        batch_id = await submit_batch(client, requests)
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    db.add(BreakdownBatch(id=batch_id, user_id=uid))
+    await db.commit()
+    return {"batch_id": batch_id, "status_url": f"/api/breakdown/batch/{batch_id}"}
+
+
+def _batch_line_steps(item: dict) -> list[dict] | None:
+    """Parsed steps for one Batch API output line, or None if it failed or is malformed."""
+    response = item.get("response") or {}
+    if response.get("status_code") != 200:
+        return None
+    try:
+        content = response["body"]["choices"][0]["message"]["content"] or ""
         return parse_steps_from_response(content)
-    except json.JSONDecodeError as e:
-        raise HTTPException(status_code=502, detail=f"Could not parse AI response as JSON: {e}")
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+
+
+@router.get("/breakdown/batch/{batch_id}")
+async def get_breakdown_batch(
+    batch_id: str,
+    db: AsyncSession = Depends(get_session),
+    user_id: str | None = Header(default=None, alias="X-User-Id"),
+):
+    """
+    Status of a batch job. Once completed, includes steps keyed by custom_id
+    for every submitted task; tasks that failed or returned bad JSON map to None.
+    """
+    uid = require_user_id(user_id)
+    statement = select(BreakdownBatch).where(
+        BreakdownBatch.id == batch_id, BreakdownBatch.user_id == uid
+    )
+    if not (await db.exec(statement)).one_or_none():
+        raise HTTPException(status_code=404, detail="Batch not found")
+    # Release the pooled connection before the OpenAI calls, which can take seconds.
+    await db.close()
+    client = _get_client()
+    try:
+        batch = await client.batches.retrieve(batch_id)
+        if batch.status != "completed":
+            return {"batch_id": batch_id, "status": batch.status}
+        total = batch.request_counts.total if batch.request_counts else 0
+        results: dict[str, list[dict] | None] = {f"task-{i}": None for i in range(total)}
+        # Successful requests are in the output file, failed ones in the error file;
+        # either may be absent if every request landed in the other.
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            content = await client.files.content(file_id)
+            for line in content.text.splitlines():
+                if not line.strip():
+                    continue
+                item = orjson.loads(line)
+                results[item["custom_id"]] = _batch_line_steps(item)
     except Exception as e:
         raise HTTPException(status_code=502, detail=str(e))
+    return {"batch_id": batch_id, "status": batch.status, "results": results}
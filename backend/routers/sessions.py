@@ -3,154 +3,172 @@ Focus sessions: start/end sessions, list recent ones (Phase 3),
 calendar link for blocking focus time (Phase 4),
 and persistence via SQLite/SQLModel (long-term data).
 """
-import uuid
 from datetime import datetime, timezone, timedelta
-from urllib.parse import quote
+from urllib.parse import quote, urlencode
 
+import uuid_utils
 from fastapi import APIRouter, Depends, Header, HTTPException
 from pydantic import BaseModel
-from sqlmodel import Session, select
+from sqlalchemy import Integer, and_, case, cast, func
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from db import get_session
+from deps import require_user_id
 from models import FocusSession
 
 router = APIRouter(prefix="/api", tags=["sessions"])
 
+_GCAL_BASE = "https://calendar.google.com/calendar/render?"
+
 
 class StartSessionRequest(BaseModel):
     task_title: str
 
 
-def _require_user_id(user_id: str | None) -> str:
-    if not user_id:
-        raise HTTPException(status_code=400, detail="Missing X-User-Id header")
-    return user_id
+class StatsResponse(BaseModel):
+    total_sessions: int
+    total_minutes: int
+    today_sessions: int
+    today_minutes: int
+
+
+class CalendarLinkResponse(BaseModel):
+    url: str
+    title: str
+
+
+def _utcnow() -> datetime:
+    """Current time as an aware UTC datetime."""
+    return datetime.now(timezone.utc)
 
 
 @router.post("/sessions")
-def start_session(
+async def start_session(
     req: StartSessionRequest,
-    db: Session = Depends(get_session),
+    db: AsyncSession = Depends(get_session),
     user_id: str | None = Header(default=None, alias="X-User-Id"),
-):
+) -> FocusSession:
     """Start a focus session. Returns the new session with id and started_at."""
-    uid = _require_user_id(user_id)
+    uid = require_user_id(user_id)
     session = FocusSession(
-        id=str(uuid.uuid4()),
+        # Time-ordered UUIDv7 so inserts append to the end of the primary-key B-tree.
+        id=str(uuid_utils.uuid7()),
         user_id=uid,
         task_title=req.task_title.strip() or "Focus",
-        started_at=datetime.now(timezone.utc),
+        started_at=_utcnow(),
     )
     db.add(session)
-    db.commit()
-    db.refresh(session)
+    await db.commit()
     return session
 
 
 @router.patch("/sessions/{session_id}")
-def end_session(
+async def end_session(
     session_id: str,
-    db: Session = Depends(get_session),
+    db: AsyncSession = Depends(get_session),
     user_id: str | None = Header(default=None, alias="X-User-Id"),
-):
+) -> FocusSession:
     """End a focus session. Sets ended_at to now."""
-    uid = _require_user_id(user_id)
+    uid = require_user_id(user_id)
     statement = select(FocusSession).where(
         FocusSession.id == session_id, FocusSession.user_id == uid
     )
-    focus_session = db.exec(statement).one_or_none()
+    focus_session = (await db.exec(statement)).one_or_none()
     if not focus_session:
         raise HTTPException(status_code=404, detail="Session not found")
     if focus_session.ended_at is not None:
         raise HTTPException(status_code=400, detail="Session already ended")
-    focus_session.ended_at = datetime.now(timezone.utc)
-    db.add(focus_session)
-    db.commit()
-    db.refresh(focus_session)
+    focus_session.ended_at = _utcnow()
+    await db.commit()
     return focus_session
 
 
 @router.get("/sessions")
-def list_sessions(
+async def list_sessions(
     limit: int = 20,
-    db: Session = Depends(get_session),
+    db: AsyncSession = Depends(get_session),
     user_id: str | None = Header(default=None, alias="X-User-Id"),
-):
+) -> list[FocusSession]:
     """List recent sessions (newest first) for this user."""
-    uid = _require_user_id(user_id)
+    uid = require_user_id(user_id)
     statement = (
         select(FocusSession)
         .where(FocusSession.user_id == uid)
         .order_by(FocusSession.started_at.desc())
+        .limit(limit)
     )
-    sessions = db.exec(statement).all()
-    return sessions[:limit]
+    result = await db.exec(statement)
+    return result.all()
 
 
 # --- Stats (Phase 5) ---
 
 
 @router.get("/stats")
-def get_stats(
-    db: Session = Depends(get_session),
+async def get_stats(
+    db: AsyncSession = Depends(get_session),
     user_id: str | None = Header(default=None, alias="X-User-Id"),
-):
+) -> StatsResponse:
     """Basic focus stats for this user: today and all-time."""
-    uid = _require_user_id(user_id)
-    statement = select(FocusSession).where(FocusSession.user_id == uid)
-    sessions = db.exec(statement).all()
-
-    now = datetime.now(timezone.utc)
-    today = now.date()
-
-    total_sessions = len(sessions)
-    total_minutes = 0
-    today_sessions = 0
-    today_minutes = 0
-
-    for s in sessions:
-        if not s.started_at or not s.ended_at:
-            continue
-        duration_min = max(
-            0, int((s.ended_at - s.started_at).total_seconds() // 60)
-        )
-        total_minutes += duration_min
-        if s.started_at.date() == today:
-            today_sessions += 1
-            today_minutes += duration_min
-
-    return {
-        "total_sessions": total_sessions,
-        "total_minutes": total_minutes,
-        "today_sessions": today_sessions,
-        "today_minutes": today_minutes,
-    }
+    uid = require_user_id(user_id)
+    today_start = _utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    started_today = FocusSession.started_at >= today_start
+    # Whole minutes per finished session, floored from the exact microsecond
+    # difference: whole seconds via strftime('%s') plus the .ffffff field SQLite
+    # datetimes are stored with. NULL for active sessions, so SUM skips them.
+    duration_us = (
+        cast(func.strftime("%s", FocusSession.ended_at), Integer)
+        - cast(func.strftime("%s", FocusSession.started_at), Integer)
+    ) * 1_000_000 + (
+        cast(func.substr(FocusSession.ended_at, 21, 6), Integer)
+        - cast(func.substr(FocusSession.started_at, 21, 6), Integer)
+    )
+    duration_min = func.max(0, duration_us // 60_000_000)
+    statement = select(
+        func.count(FocusSession.id),
+        func.coalesce(func.sum(duration_min), 0),
+        func.count(
+            case((and_(started_today, FocusSession.ended_at.is_not(None)), 1))
+        ),
+        func.coalesce(func.sum(case((started_today, duration_min))), 0),
+    ).where(FocusSession.user_id == uid)
+    result = await db.exec(statement)
+    total_sessions, total_minutes, today_sessions, today_minutes = result.one()
+
+    return StatsResponse(
+        total_sessions=total_sessions,
+        total_minutes=total_minutes,
+        today_sessions=today_sessions,
+        today_minutes=today_minutes,
+    )
 
 
 # --- Calendar link helpers ---
 
 def _to_google_calendar_format(dt: datetime) -> str:
-    """Format as YYYYMMDDTHHMMSSZ for Google Calendar URL."""
-    if dt.tzinfo is None:
-        dt = dt.replace(tzinfo=timezone.utc)
-    return dt.strftime("%Y%m%dT%H%M%SZ")
+    """Format as YYYYMMDDTHHMMSSZ for Google Calendar URL. dt must already be UTC."""
+    return (
+        f"{dt.year:04d}{dt.month:02d}{dt.day:02d}"
+        f"T{dt.hour:02d}{dt.minute:02d}{dt.second:02d}Z"
+    )
 
 
 @router.get("/sessions/{session_id}/calendar-link")
-def get_calendar_link(
+async def get_calendar_link(
     session_id: str,
-    db: Session = Depends(get_session),
+    db: AsyncSession = Depends(get_session),
     user_id: str | None = Header(default=None, alias="X-User-Id"),
-):
+) -> CalendarLinkResponse:
     """
     Get a Google Calendar URL for this session so the user can block time.
     For an active session (no ended_at), end time is set to start + 60 minutes.
     """
-    uid = _require_user_id(user_id)
+    uid = require_user_id(user_id)
     statement = select(FocusSession).where(
         FocusSession.id == session_id, FocusSession.user_id == uid
     )
-    session = db.exec(statement).one_or_none()
+    session = (await db.exec(statement)).one_or_none()
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     start_dt = session.started_at
@@ -161,6 +179,5 @@ def get_calendar_link(
         "text": title,
         "dates": f"{_to_google_calendar_format(start_dt)}/{_to_google_calendar_format(end_dt)}",
     }
-    qs = "&".join(f"{k}={quote(str(v))}" for k, v in params.items())
-    url = f"https://calendar.google.com/calendar/render?{qs}"
-    return {"url": url, "title": title}
+    url = _GCAL_BASE + urlencode(params, safe="/", quote_via=quote)
+    return CalendarLinkResponse(url=url, title=title)
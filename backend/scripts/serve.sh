@@ -0,0 +1,16 @@
+#!/usr/bin/env sh
+# Production server: one uvicorn worker per core (override with WEB_CONCURRENCY),
+# uvloop event loop and httptools parser (both from uvicorn[standard]).
+set -e
+cd "$(dirname "$0")/.."
+# Create the schema once up front; workers starting together would otherwise
+# race each other's CREATE TABLE on a fresh database.
+python -c "import asyncio, db; asyncio.run(db.create_schema())"
+exec uvicorn main:app \
+  --host 0.0.0.0 \
+  --port "${PORT:-8000}" \
+  --workers "${WEB_CONCURRENCY:-$(nproc)}" \
+  --loop uvloop \
+  --http httptools \
+  --no-access-log \
+  --timeout-keep-alive 15